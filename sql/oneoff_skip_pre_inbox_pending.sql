@@ -0,0 +1,28 @@
+-- ONE-SHOT. Run once, after stripe_webhook_inbox.sql and before the first
+-- deploy of the inbox worker (heroku pg:psql < this file).
+--
+-- The worker applies every row with processed_at IS NULL. Before the inbox,
+-- those were only events whose inline handler died partway (e.g. a dyno
+-- restart); replaying them now would re-post support messages, PATCH
+-- long-expired interaction tokens, and re-run stale revocations. Mark them
+-- handled so the worker starts from an empty queue.
+--
+-- Once the worker is live, pending rows are real work, so a second run must
+-- not touch them: the marker row is inserted with the update, and if it's
+-- already there the update matches nothing.
+CREATE TABLE IF NOT EXISTS schema_oneoffs (
+    name   text PRIMARY KEY,
+    ran_at timestamptz NOT NULL DEFAULT NOW()
+);
+
+WITH first_run AS (
+    INSERT INTO schema_oneoffs (name)
+    VALUES ('skip_pre_inbox_pending')
+    ON CONFLICT (name) DO NOTHING
+    RETURNING 1
+)
+UPDATE stripe_webhook_events
+   SET processed_at = NOW(),
+       last_error   = COALESCE(last_error, 'skipped: pending before inbox worker deploy')
+ WHERE processed_at IS NULL
+   AND EXISTS (SELECT 1 FROM first_run);
@@ -0,0 +1,25 @@
+-- Schema the inbox worker in webhook.py relies on. Run against DATABASE_URL
+-- before deploying that version (heroku pg:psql < this file). Everything here
+-- is idempotent and safe to re-run. The one-time cleanup of rows left pending
+-- by the old inline handler lives in oneoff_skip_pre_inbox_pending.sql; run
+-- that once, after this file and before the deploy.
+
+-- Failed events are retried with backoff and given up on after
+-- INBOX_MAX_ATTEMPTS; last_error keeps the final failure for inspection.
+ALTER TABLE stripe_webhook_events
+    ADD COLUMN IF NOT EXISTS attempts   integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_error text,
+    ADD COLUMN IF NOT EXISTS retry_at   timestamptz;
+
+-- Claim order. Existing rows get the time this runs, which is fine since
+-- they're all already processed or skipped by the one-off script.
+ALTER TABLE stripe_webhook_events
+    ADD COLUMN IF NOT EXISTS received_at timestamptz NOT NULL DEFAULT NOW();
+
+-- The table is an append-only audit log; the worker only ever looks at the
+-- handful of pending rows, so index just those. Every drain pass ends with a
+-- claim that finds nothing, and this keeps that an index probe, not a seq scan.
+-- (CONCURRENTLY: don't block webhook inserts while it builds.)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS stripe_webhook_events_pending_idx
+    ON stripe_webhook_events (received_at)
+    WHERE processed_at IS NULL;
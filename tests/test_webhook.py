@@ -0,0 +1,83 @@
+import hashlib
+import hmac
+import os
+import time
+from contextlib import nullcontext
+
+import pytest
+
+# webhook.py reads its config at import. Nothing listens on this DSN: the pool
+# and the inbox worker only try to connect in the background, and the route's
+# DB access is faked below.
+os.environ.setdefault("DATABASE_URL", "postgresql://127.0.0.1:1/test")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_dummy")
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_test")
+os.environ.setdefault("PREMIUM_PRICE_ID", "price_test")
+
+import webhook  # noqa: E402
+
+BODY = b'{"id":"evt_1","type":"invoice.paid","data":{"object":{"id":"in_1"}}}'
+
+
+def sign(body, secret=None, ts=None):
+    ts = int(time.time()) if ts is None else ts
+    signed = f"{ts}.{body.decode('utf-8')}".encode("utf-8")
+    mac = hmac.new((secret or webhook.WEBHOOK_SECRET).encode("utf-8"), signed, hashlib.sha256)
+    return f"t={ts},v1={mac.hexdigest()}"
+
+
+class FakeConn:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def pipeline(self):
+        return nullcontext()
+
+    def cursor(self):
+        return nullcontext(object())
+
+
+@pytest.fixture
+def client(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(webhook, "get_db", FakeConn)
+    monkeypatch.setattr(webhook, "upsert_event",
+                        lambda cur, event_id, event_type, obj: recorded.append((event_id, event_type, obj)) or True)
+    monkeypatch.setattr(webhook, "notify_inbox", lambda cur: None)
+    c = webhook.app.test_client()
+    c.recorded = recorded
+    return c
+
+
+def post(client, body, sig):
+    return client.post("/stripe-webhook", data=body, headers={"Stripe-Signature": sig},
+                       content_type="application/json")
+
+
+def test_signed_event_is_recorded(client):
+    r = post(client, BODY, sign(BODY))
+    assert r.status_code == 200
+    assert r.data == b'{"ok":true}'
+    assert client.recorded == [("evt_1", "invoice.paid", {"id": "in_1"})]
+
+
+def test_wrong_secret_is_rejected(client):
+    r = post(client, BODY, sign(BODY, secret="whsec_other"))
+    assert r.status_code == 400
+    assert client.recorded == []
+
+
+def test_stale_timestamp_is_rejected(client):
+    old = int(time.time()) - webhook.stripe.Webhook.DEFAULT_TOLERANCE - 60
+    r = post(client, BODY, sign(BODY, ts=old))
+    assert r.status_code == 400
+    assert client.recorded == []
+
+
+def test_non_utf8_body_is_rejected(client):
+    r = post(client, b"\xff\xfe", "t=1,v1=00")
+    assert r.status_code == 400
+    assert client.recorded == []
@@ -1,10 +1,20 @@
 import os
-import json
+import logging
+import time
+import atexit
+import threading
+import orjson
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import stripe
-import psycopg2
-from flask import Flask, request, jsonify
+import psycopg
+from psycopg.types.json import Jsonb, set_json_dumps, set_json_loads
+from psycopg_pool import ConnectionPool
+from flask import Flask, request
 from datetime import datetime, timezone
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Config
@@ -15,153 +25,308 @@ WEBHOOK_SECRET      = os.getenv("STRIPE_WEBHOOK_SECRET")
 PREMIUM_PRICE_ID    = os.getenv("PREMIUM_PRICE_ID")              # e.g. price_123
 DISCORD_API_BASE    = os.getenv("DISCORD_API_BASE", "https://discord.com/api/v10")
 SUPPORT_WEBHOOK     = os.getenv("SUPPORT_WEBHOOK")               # optional
+WEB_THREADS         = int(os.getenv("WEB_THREADS", "8"))         # gunicorn --threads (see Procfile)
 
 assert BUBU_DATABASE_URL and STRIPE_SECRET_KEY and WEBHOOK_SECRET and PREMIUM_PRICE_ID, \
     "Missing one of: BUBU_DATABASE_URL, STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET, PREMIUM_PRICE_ID"
 
+logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+log = logging.getLogger(__name__)
+
 stripe.api_key = STRIPE_SECRET_KEY
 app = Flask(__name__)
+# Reject oversized bodies with 413 before they're read into memory. Stripe
+# events are usually a few KB; invoices with many lines can reach ~100s of KB.
+app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+# jsonb params are bound as Jsonb(...) and (de)serialized by orjson in-driver.
+set_json_dumps(orjson.dumps)
+set_json_loads(orjson.loads)
+
+# Connection settings shared by the pool and the inbox LISTEN connection;
+# passed as libpq kwargs so the DSN is never rewritten.
+_CONN_KW = {
+    "sslmode": "require",
+    "application_name": "bubu-webhook",
+    "options": "-c timezone=UTC",
+}
+
+# One pool per worker process; connections are reused across requests instead
+# of paying TCP + TLS + auth on every helper call. At most one connection per
+# request thread plus one for the inbox worker; with its LISTEN connection a
+# process holds up to WEB_THREADS + 2, so a dyno needs
+# WEB_CONCURRENCY * (WEB_THREADS + 2) Postgres connections at peak.
+POOL = ConnectionPool(
+    BUBU_DATABASE_URL,
+    min_size=2,
+    max_size=WEB_THREADS + 1,
+    kwargs=_CONN_KW,
+    open=True,
+)
+
+# Shared keep-alive session for Discord + support webhook calls, so we don't
+# redo DNS + TCP + TLS to discord.com on every event. Only the idempotent
+# PATCH is retried; re-POSTing a support message could duplicate it.
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset({"PATCH"})),
+))
+
+# Outbound HTTP runs off the inbox worker once the DB commit is done, so a
+# slow Discord call doesn't hold up the next event. Drained on exit.
+_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="outbound")
+atexit.register(_EXEC.shutdown, wait=True)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # DB helpers
 # ─────────────────────────────────────────────────────────────────────────────
+# Every statement is a module constant executed with prepare=True, so each
+# pooled connection parses/plans it once and reuses the plan afterwards.
 def get_db():
-    return psycopg2.connect(BUBU_DATABASE_URL, sslmode="require", options="-c timezone=UTC")
+    """
+    Borrow a pooled connection for one transaction (commit on success,
+    rollback on error); it goes back to the pool when the block exits.
+    """
+    return POOL.connection()
 
-def upsert_event(event_id: str, event_type: str, payload: dict) -> bool:
+SQL_INSERT_EVENT = """
+    INSERT INTO stripe_webhook_events (event_id, event_type, payload)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (event_id) DO NOTHING
+    RETURNING 1
+"""
+
+def upsert_event(cur, event_id: str, event_type: str, payload: dict) -> bool:
     """
     Returns True if this event is NEW and should be processed.
     Returns False if we've already seen it.
     """
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO stripe_webhook_events (event_id, event_type, payload)
-            VALUES (%s, %s, %s::jsonb)
-            ON CONFLICT (event_id) DO NOTHING
-        """, (event_id, event_type, json.dumps(payload)))
-        return cur.rowcount == 1
-
-def mark_event_processed(event_id: str):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE stripe_webhook_events SET processed_at = NOW() WHERE event_id = %s", (event_id,))
-
-def upsert_stripe_customer(user_id: int, customer_id: str):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO stripe_customers (user_id, customer_id)
-            VALUES (%s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET customer_id = EXCLUDED.customer_id
-        """, (user_id, customer_id))
-
-def upsert_stripe_subscription(user_id: int, sub_obj: dict):
+    cur.execute(SQL_INSERT_EVENT, (event_id, event_type, Jsonb(payload)), prepare=True)
+    return cur.fetchone() is not None
+
+SQL_MARK_EVENT_PROCESSED = "UPDATE stripe_webhook_events SET processed_at = NOW() WHERE event_id = %s"
+
+def mark_event_processed(cur, event_id: str):
+    cur.execute(SQL_MARK_EVENT_PROCESSED, (event_id,), prepare=True)
+
+SQL_NOTIFY_INBOX = "SELECT pg_notify(%s, '')"
+
+def notify_inbox(cur):
+    cur.execute(SQL_NOTIFY_INBOX, (INBOX_CHANNEL,), prepare=True)
+
+# Transaction-local `SET LOCAL synchronous_commit = off`, in a preparable form.
+SQL_ASYNC_COMMIT = "SELECT set_config('synchronous_commit', 'off', true)"
+
+def async_commit(cur):
+    cur.execute(SQL_ASYNC_COMMIT, prepare=True)
+
+SQL_CLAIM_EVENT = """
+    SELECT event_id, event_type, payload
+      FROM stripe_webhook_events
+     WHERE processed_at IS NULL
+       AND (retry_at IS NULL OR retry_at <= NOW())
+     ORDER BY received_at
+     LIMIT 1
+       FOR UPDATE SKIP LOCKED
+"""
+
+def claim_event(cur):
+    cur.execute(SQL_CLAIM_EVENT, prepare=True)
+    return cur.fetchone()  # (event_id, event_type, payload) or None
+
+# Backs off 1, 2, 4, 8... minutes; after max_attempts the event is marked
+# processed (as the pre-inbox code did on failure) with the error kept.
+SQL_RECORD_FAILURE = """
+    UPDATE stripe_webhook_events
+       SET attempts     = attempts + 1,
+           last_error   = %(error)s,
+           retry_at     = NOW() + interval '1 minute' * power(2, attempts),
+           processed_at = CASE WHEN attempts + 1 >= %(max_attempts)s THEN NOW() END
+     WHERE event_id = %(event_id)s
+    RETURNING processed_at IS NOT NULL, attempts
+"""
+
+def record_failure(cur, event_id: str, error: str, max_attempts: int) -> tuple[bool, int]:
+    """Returns (gave_up, attempts) for the failed event."""
+    cur.execute(SQL_RECORD_FAILURE, {
+        "event_id":     event_id,
+        "error":        error,
+        "max_attempts": max_attempts,
+    }, prepare=True)
+    return cur.fetchone()
+
+SQL_MIRROR_SUBSCRIPTION = """
+    WITH customer AS (
+        INSERT INTO stripe_customers (user_id, customer_id)
+        SELECT %(user_id)s::bigint, %(customer_id)s::text
+         WHERE %(customer_id)s::text IS NOT NULL
+        ON CONFLICT (user_id) DO UPDATE SET customer_id = EXCLUDED.customer_id
+    ), subscription AS (
+        INSERT INTO stripe_subscriptions
+          (subscription_id, user_id, price_id, status, current_period_start,
+           current_period_end, cancel_at_period_end, created_at, updated_at)
+        VALUES (%(sub_id)s, %(user_id)s, %(price_id)s, %(status)s, %(cps)s,
+                %(cpe)s, %(cancel_at_period_end)s, NOW(), NOW())
+        ON CONFLICT (subscription_id) DO UPDATE
+           SET user_id = EXCLUDED.user_id,
+               price_id = EXCLUDED.price_id,
+               status   = EXCLUDED.status,
+               current_period_start = EXCLUDED.current_period_start,
+               current_period_end   = EXCLUDED.current_period_end,
+               cancel_at_period_end = EXCLUDED.cancel_at_period_end,
+               updated_at = NOW()
+    ), promote AS (
+        INSERT INTO users (user_id, tier, premium_until)
+        SELECT %(user_id)s::bigint, 'premium', %(until)s::timestamptz
+         WHERE %(promote)s::boolean
+        ON CONFLICT (user_id) DO UPDATE
+           SET tier = 'premium', premium_until = EXCLUDED.premium_until
+         WHERE users.tier IS DISTINCT FROM 'premium'
+            OR users.premium_until IS DISTINCT FROM EXCLUDED.premium_until
+    )
+    INSERT INTO premium_audit (user_id, action, source, meta)
+    SELECT %(user_id)s::bigint, 'sync', 'stripe', %(meta)s
+     WHERE %(promote)s::boolean
+"""
+
+def mirror_subscription(cur, user_id: int, sub_obj: dict, promote: bool):
+    """
+    Mirrors the Stripe customer + subscription rows and, if promote is set,
+    upgrades the user and writes the audit entry — all in one statement.
+    """
     # extract fields safely
     sub_id  = sub_obj.get("id")
     status  = sub_obj.get("status")
     cancel_at_period_end = bool(sub_obj.get("cancel_at_period_end", False))
     cpe    = sub_obj.get("current_period_end")
     cps    = sub_obj.get("current_period_start")
-    price  = None
-    try:
-        items = sub_obj.get("items", {}).get("data", [])
-        if items:
-            price = items[0].get("price", {}).get("id")
-    except Exception:
-        price = None
-
-    cpe_dt = datetime.fromtimestamp(cpe, tz=timezone.utc) if cpe else None
-    cps_dt = datetime.fromtimestamp(cps, tz=timezone.utc) if cps else None
-
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO stripe_subscriptions
-              (subscription_id, user_id, price_id, status, current_period_start,
-               current_period_end, cancel_at_period_end, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-            ON CONFLICT (subscription_id) DO UPDATE
-               SET user_id = EXCLUDED.user_id,
-                   price_id = EXCLUDED.price_id,
-                   status   = EXCLUDED.status,
-                   current_period_start = EXCLUDED.current_period_start,
-                   current_period_end   = EXCLUDED.current_period_end,
-                   cancel_at_period_end = EXCLUDED.cancel_at_period_end,
-                   updated_at = NOW()
-        """, (sub_id, user_id, price, status, cps_dt, cpe_dt, cancel_at_period_end))
-
-def ensure_user(user_id: int):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO users (user_id) VALUES (%s)
-            ON CONFLICT (user_id) DO NOTHING
-        """, (user_id,))
-
-def set_premium(user_id: int, until: datetime | None, source: str, action: str):
-    ensure_user(user_id)
-    with get_db() as conn, conn.cursor() as cur:
-        # if until is None: fall back to NOW()+30d (but we prefer explicit period end)
-        if until is None:
-            until = datetime.now(timezone.utc)
-        cur.execute("""
-            UPDATE users
-               SET tier = 'premium', premium_until = %s
-             WHERE user_id = %s
-        """, (until, user_id))
-        cur.execute("""
-            INSERT INTO premium_audit (user_id, action, source, meta)
-            VALUES (%s, %s, %s, %s::jsonb)
-        """, (user_id, action, source, json.dumps({"premium_until": until.isoformat()})))
-
-def set_free(user_id: int, source: str, reason: str):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            UPDATE users
-               SET tier = 'free', premium_until = NULL
-             WHERE user_id = %s
-        """, (user_id,))
-        cur.execute("""
-            INSERT INTO premium_audit (user_id, action, source, meta)
-            VALUES (%s, 'revoke', %s, %s::jsonb)
-        """, (user_id, source, json.dumps({"reason": reason})))
+    price  = sub_price_id(sub_obj)
+
+    cust_id = sub_obj.get("customer")
+    if isinstance(cust_id, dict):
+        cust_id = cust_id.get("id")
+
+    cpe_dt = from_epoch(cpe)
+    cps_dt = from_epoch(cps)
+
+    # if there's no period end: fall back to NOW() (but we prefer explicit period end)
+    until = cpe_dt or datetime.now(timezone.utc)
+
+    # The users upsert must stay an upsert: sibling CTEs see the same snapshot,
+    # so a separate "INSERT ... DO NOTHING" + UPDATE pair would miss a new user.
+    # It skips rows already in the target state — one renewal fires both
+    # invoice.payment_succeeded and customer.subscription.updated.
+    cur.execute(SQL_MIRROR_SUBSCRIPTION, {
+        "user_id":     user_id,
+        "customer_id": cust_id or None,
+        "sub_id":      sub_id,
+        "price_id":    price,
+        "status":      status,
+        "cps":         cps_dt,
+        "cpe":         cpe_dt,
+        "cancel_at_period_end": cancel_at_period_end,
+        "until":       until,
+        "promote":     promote,
+        "meta":        Jsonb({"premium_until": until.isoformat()}),
+    }, prepare=True)
+
+SQL_SET_FREE = """
+    WITH resolved AS (
+        SELECT COALESCE(
+                   %(user_id)s::bigint,
+                   (SELECT user_id FROM stripe_subscriptions WHERE subscription_id = %(sub_id)s)
+               ) AS user_id
+    ), target AS (
+        -- Don't revoke a user who still has (e.g. re-subscribed to) another
+        -- live premium subscription; matters when a deletion arrives late.
+        SELECT r.user_id
+          FROM resolved r
+         WHERE r.user_id IS NOT NULL
+           AND NOT EXISTS (
+                SELECT 1
+                  FROM stripe_subscriptions s
+                 WHERE s.user_id = r.user_id
+                   AND s.subscription_id IS DISTINCT FROM %(sub_id)s
+                   AND s.status = ANY(%(premium_statuses)s::text[])
+           )
+    ), u AS (
+        UPDATE users
+           SET tier = 'free', premium_until = NULL
+         WHERE user_id = (SELECT user_id FROM target)
+           AND (tier IS DISTINCT FROM 'free' OR premium_until IS NOT NULL)
+    )
+    INSERT INTO premium_audit (user_id, action, source, meta)
+    SELECT user_id, 'revoke', %(source)s, %(meta)s
+      FROM target
+    RETURNING user_id
+"""
+
+def set_free(cur, user_id: int | None, source: str, reason: str, sub_id: str | None = None) -> int | None:
+    """
+    Revokes premium and writes the audit row in one statement.
+    If user_id is unknown, it's resolved from our stored subscription row.
+    Skipped if the user has another trialing/active subscription mirrored.
+    Returns the revoked user_id, or None if nobody was revoked.
+    """
+    cur.execute(SQL_SET_FREE, {
+        "user_id": user_id,
+        "sub_id":  sub_id,
+        "premium_statuses": sorted(PREMIUM_STATUSES),
+        "source":  source,
+        "meta":    Jsonb({"reason": reason}),
+    }, prepare=True)
+    row = cur.fetchone()
+    return row[0] if row else None
 
 def patch_interaction_original(application_id: int | str, interaction_token: str, payload: dict):
     url = f"{DISCORD_API_BASE}/webhooks/{int(application_id)}/{interaction_token}/messages/@original"
     try:
-        r = requests.patch(url, json=payload, timeout=8)
-        print(f"[discord] PATCH @original -> {r.status_code} {r.text[:200]}")
+        r = _HTTP.patch(url, json=payload, timeout=8)
+        # Only decode the response body when something went wrong.
+        if r.ok:
+            log.info("[discord] PATCH @original -> %s", r.status_code)
+        else:
+            log.warning("[discord] PATCH @original -> %s %r", r.status_code, r.content[:200])
     except Exception as e:
-        print("⚠️ PATCH failed:", e)
+        log.warning("⚠️ PATCH failed: %s", e)
 
-def find_checkout_mapping(stripe_session_id: str):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT interaction_token, application_id, user_id
-              FROM premium_checkout_sessions
-             WHERE stripe_session_id = %s
-        """, (stripe_session_id,))
-        return cur.fetchone()  # (token, app_id, user_id) or None
+SQL_FIND_CHECKOUT_MAPPING = """
+    SELECT interaction_token, application_id, user_id
+      FROM premium_checkout_sessions
+     WHERE stripe_session_id = %s
+"""
+
+def find_checkout_mapping(cur, stripe_session_id: str):
+    cur.execute(SQL_FIND_CHECKOUT_MAPPING, (stripe_session_id,), prepare=True)
+    return cur.fetchone()  # (token, app_id, user_id) or None
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Core sync logic
 # ─────────────────────────────────────────────────────────────────────────────
-def sync_user_from_subscription(sub_id: str, explicit_user_id: int | None = None) -> int | None:
+SQL_SUBSCRIPTION_USER = "SELECT user_id FROM stripe_subscriptions WHERE subscription_id = %s"
+
+PREMIUM_STATUSES = frozenset({"trialing", "active"})
+
+def sync_user_from_subscription(cur, sub: dict | None = None, sub_id: str | None = None,
+                                explicit_user_id: int | None = None) -> int | None:
     """
-    Fetches Stripe subscription and mirrors to DB + users.tier/premium_until.
+    Mirrors a Stripe subscription to DB + users.tier/premium_until.
+    Pass an already-retrieved `sub` to skip the Stripe fetch; otherwise it's
+    retrieved by `sub_id`.
     Returns the discord user_id (int) if resolved.
     """
-    sub = stripe.Subscription.retrieve(sub_id, expand=["items.data.price", "customer"])
+    if sub is None:
+        sub = stripe.Subscription.retrieve(sub_id, expand=["items.data.price", "customer"])
+    sub_id = sub.get("id") or sub_id
     status = sub.get("status")
-    cpe    = sub.get("current_period_end")
-    until  = datetime.fromtimestamp(cpe, tz=timezone.utc) if cpe else None
-    price_id = None
-    try:
-        items = sub.get("items", {}).get("data", [])
-        if items:
-            price_id = items[0].get("price", {}).get("id")
-    except Exception:
-        pass
+    price_id = sub_price_id(sub)
 
     # sanity: only handle our premium price
     if price_id != PREMIUM_PRICE_ID:
-        print(f"↪️ Ignoring subscription {sub_id} with price {price_id} (not PREMIUM_PRICE_ID)")
+        log.info("↪️ Ignoring subscription %s with price %s (not PREMIUM_PRICE_ID)", sub_id, price_id)
         return None
 
     # Resolve user_id: prefer sub.metadata.user_id; fallback to explicit_user_id; else lookup existing row
@@ -169,158 +334,275 @@ def sync_user_from_subscription(sub_id: str, explicit_user_id: int | None = None
     user_id = explicit_user_id or safe_int(md.get("user_id"))
     if user_id is None:
         # fallback to previously stored subscription row
-        with get_db() as conn, conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM stripe_subscriptions WHERE subscription_id = %s", (sub_id,))
-            row = cur.fetchone()
-            user_id = row[0] if row else None
+        cur.execute(SQL_SUBSCRIPTION_USER, (sub_id,), prepare=True)
+        row = cur.fetchone()
+        user_id = row[0] if row else None
 
     if user_id is None:
-        print(f"⚠️ Could not resolve user_id for subscription {sub_id}")
+        log.warning("⚠️ Could not resolve user_id for subscription %s", sub_id)
         return None
 
-    # Mirror customer
-    cust_id = sub.get("customer")
-    if isinstance(cust_id, dict):
-        cust_id = cust_id.get("id")
-    if cust_id:
-        upsert_stripe_customer(user_id, cust_id)
-
-    # Mirror subscription row
-    upsert_stripe_subscription(user_id, sub)
-
-    # Apply user tier state
-    if status in ("trialing", "active"):
-        set_premium(user_id, until, source="stripe", action="sync")
-    else:
+    # Mirror customer + subscription rows, and apply user tier state
+    promote = status in PREMIUM_STATUSES
+    mirror_subscription(cur, user_id, sub, promote=promote)
+    if not promote:
         # Non-active states get no extension; only revoke on deleted/canceled handler
-        print(f"ℹ️ Subscription {sub_id} status={status}; not promoting to premium")
+        log.info("ℹ️ Subscription %s status=%s; not promoting to premium", sub_id, status)
     return user_id
 
+def sub_price_id(sub_obj: dict) -> str | None:
+    """First item's price id of a subscription object, or None if not present."""
+    try:
+        items = sub_obj.get("items", {}).get("data", [])
+        if items:
+            return items[0].get("price", {}).get("id")
+    except Exception:
+        pass
+    return None
+
+def foreign_price(sub_obj: dict) -> bool:
+    """
+    True if the subscription object carries a price and it isn't ours.
+    subscription.* webhook payloads inline items.data.price, so this lets us
+    skip the Stripe retrieve for other products. Unknown price -> False.
+    """
+    price_id = sub_price_id(sub_obj)
+    return price_id is not None and price_id != PREMIUM_PRICE_ID
+
 def safe_int(v):
     try:
         return int(v) if v is not None else None
     except Exception:
         return None
 
+@lru_cache(maxsize=128)
+def from_epoch(ts: int | None) -> datetime | None:
+    # Stripe sends unix seconds; the same period bounds recur across the
+    # invoice/subscription events of one renewal, so keep recent conversions.
+    return datetime.fromtimestamp(ts, tz=timezone.utc) if ts else None
+
 def post_support(msg: str):
     if not SUPPORT_WEBHOOK:
         return
     try:
-        requests.post(SUPPORT_WEBHOOK, json={"content": msg}, timeout=5)
+        _HTTP.post(SUPPORT_WEBHOOK, json={"content": msg}, timeout=5)
     except Exception:
         pass
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Event handling
+# ─────────────────────────────────────────────────────────────────────────────
+# Each handler applies one event type through `cur`. Outbound notifications
+# are appended to `outbox` as (fn, *args), to be sent only after commit.
+
+# ── Checkout completed (new sub) ──────────────────────────────────────────────
+def _on_checkout(cur, session: dict, outbox: list):
+    if session.get("mode") != "subscription":
+        return
+    stripe_session_id = session.get("id")
+    sub_id = session.get("subscription")
+    user_id = safe_int(session.get("client_reference_id"))  # we pass discord user id here
+    price_id = None
+
+    # Optional: ensure it's our premium price before proceeding
+    try:
+        sub = stripe.Subscription.retrieve(sub_id, expand=["items.data.price", "customer"])
+        price_id = sub_price_id(sub)
+    except Exception as e:
+        log.warning("⚠️ Could not fetch sub on checkout: %s", e)
+
+    if price_id != PREMIUM_PRICE_ID:
+        log.info("↪️ Ignoring checkout for non-premium price %s", price_id)
+        return
+
+    # Mirror all rows + promote user
+    resolved_user_id = sync_user_from_subscription(cur, sub=sub, explicit_user_id=user_id)
+
+    # If we saved mapping, PATCH @original with success embed
+    mapping = find_checkout_mapping(cur, stripe_session_id)
+    if mapping:
+        interaction_token, application_id, mapped_user = mapping
+        if not resolved_user_id or mapped_user != resolved_user_id:
+            # fallback; still patch success without user check
+            pass
+        outbox.append((patch_interaction_original, application_id, interaction_token, _ACTIVATED_PAYLOAD))
+
+    outbox.append((post_support, f"🎉 User `{resolved_user_id}` started Bubu Bot Premium (sub `{sub_id}`)."))
+
+_ACTIVATED_PAYLOAD = {
+    "embeds": [{
+        "title": "☑️ Bubu Bot Premium Activated",
+        "description": "Thanks for your support! You now have access to all premium features.",
+        "color": 0xBCE5FF
+    }],
+    "components": []
+}
+
+# ── Renewals ──────────────────────────────────────────────────────────────────
+def _on_renewal(cur, invoice: dict, outbox: list):
+    sub_id = invoice.get("subscription")
+    if sub_id:
+        user_id = sync_user_from_subscription(cur, sub_id=sub_id)
+        if user_id:
+            outbox.append((post_support, f"🔁 Premium renewed for user `{user_id}` (sub `{sub_id}`)."))
+
+# ── Payment failed (we DO NOT immediately revoke; wait for cancel/delete) ─────
+def _on_payment_failed(cur, invoice: dict, outbox: list):
+    sub_id = invoice.get("subscription")
+    if sub_id:
+        # still sync rows (status may be past_due)
+        sync_user_from_subscription(cur, sub_id=sub_id)
+
+# ── Subscription updated (e.g., cancel_at_period_end toggled) ─────────────────
+def _on_subscription_updated(cur, sub: dict, outbox: list):
+    if foreign_price(sub):
+        log.info("↪️ Ignoring subscription %s with price %s (not PREMIUM_PRICE_ID)", sub.get("id"), sub_price_id(sub))
+        return
+    sync_user_from_subscription(cur, sub_id=sub.get("id"))
+
+# ── Subscription canceled/deleted (hard revoke) ───────────────────────────────
+def _on_subscription_deleted(cur, sub: dict, outbox: list):
+    sub_id = sub.get("id")
+    user_id = None
+    # A foreign price would be ignored by the sync anyway; skip its Stripe
+    # fetch but still revoke if we have the sub stored (e.g. price changed).
+    if not foreign_price(sub):
+        user_id = sync_user_from_subscription(cur, sub_id=sub_id)  # final state mirror
+    # Resolves user from our table if not in metadata
+    user_id = set_free(cur, user_id, source="stripe", reason="subscription_deleted", sub_id=sub_id)
+    if user_id:
+        outbox.append((post_support, f"❌ Premium canceled for user `{user_id}` (sub `{sub_id}`)."))
+
+def _on_other(cur, obj: dict, outbox: list):
+    pass
+
+_STRIPE_HANDLERS = {
+    "checkout.session.completed":    _on_checkout,
+    "invoice.payment_succeeded":     _on_renewal,
+    "invoice.payment_failed":        _on_payment_failed,
+    "customer.subscription.updated": _on_subscription_updated,
+    "customer.subscription.deleted": _on_subscription_deleted,
+}
+
+def handle_event(cur, event_type: str, obj: dict, outbox: list):
+    """
+    Applies one Stripe event to the DB through `cur`.
+    Event types we don't handle are recorded and otherwise ignored.
+    """
+    _STRIPE_HANDLERS.get(event_type, _on_other)(cur, obj, outbox)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Inbox worker
+# ─────────────────────────────────────────────────────────────────────────────
+# The route only records the event in stripe_webhook_events and NOTIFYs; this
+# thread (one per worker process) applies it. Rows stay processed_at IS NULL
+# until their handler commits; a failing event is retried with backoff, then
+# given up on and reported to support. SKIP LOCKED keeps workers in different
+# processes off each other's events. Needs sql/stripe_webhook_inbox.sql.
+INBOX_CHANNEL      = "stripe_webhook_inbox"
+INBOX_POLL_SECONDS = 60   # also sweep for missed/retryable events this often
+INBOX_MAX_ATTEMPTS = 5
+
+def drain_inbox():
+    """
+    Processes ready events one transaction each until none are left.
+    A failing event is rolled back to a savepoint and its failure recorded
+    under the same row lock, so it isn't claimed again until its retry_at.
+    """
+    while True:
+        outbox = []
+        with get_db() as conn, conn.pipeline(), conn.cursor() as cur:
+            # Don't wait for WAL fsync on commit. A crash can lose the last
+            # few ms of commits, but that drops the processed_at mark along
+            # with the writes, so the event is simply reprocessed. The
+            # route's inbox insert keeps the default: Stripe won't redeliver
+            # after a 2xx, so that row must be durable.
+            async_commit(cur)
+            row = claim_event(cur)
+            if row is None:
+                return
+            event_id, event_type, obj = row
+            try:
+                with conn.transaction():
+                    handle_event(cur, event_type, obj, outbox)
+                    mark_event_processed(cur, event_id)
+            except Exception as e:
+                log.exception("⚠️ Failed to process event %s", event_id)
+                outbox = []
+                gave_up, attempts = record_failure(cur, event_id, repr(e)[:1000], INBOX_MAX_ATTEMPTS)
+                if gave_up:
+                    outbox.append((post_support, f"🚨 Gave up on Stripe event `{event_id}` ({event_type}) "
+                                                 f"after {attempts} attempts: `{repr(e)[:300]}`"))
+
+        for fn, *args in outbox:
+            _EXEC.submit(fn, *args)
+
+def _inbox_worker():
+    while True:
+        try:
+            with psycopg.connect(BUBU_DATABASE_URL, autocommit=True, **_CONN_KW) as conn:
+                conn.execute(f"LISTEN {INBOX_CHANNEL}")
+                while True:
+                    drain_inbox()
+                    for _ in conn.notifies(timeout=INBOX_POLL_SECONDS, stop_after=1):
+                        pass
+                    # One drain covers every event already NOTIFYed; swallow the
+                    # rest of a burst instead of draining once per webhook.
+                    for _ in conn.notifies(timeout=0):
+                        pass
+        except Exception:
+            log.exception("⚠️ Inbox worker error, restarting")
+            time.sleep(5)
+
+threading.Thread(target=_inbox_worker, name="stripe-inbox", daemon=True).start()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Webhook
 # ─────────────────────────────────────────────────────────────────────────────
+# Built once; these carry no per-request state, so they're safe to return
+# from every request.
+_OK    = app.response_class(response=b'{"ok":true}', status=200, mimetype="application/json")
+_DEDUP = app.response_class(response=b'{"ok":true,"dedup":true}', status=200, mimetype="application/json")
+
 @app.route("/stripe-webhook", methods=["POST"])
 def stripe_webhook():
     payload = request.data
     sig = request.headers.get("stripe-signature")
 
+    # Cheap reject before hashing the body: no header, or no v1 signature in it.
+    if not sig or "v1=" not in sig:
+        return "Invalid signature", 400
+
+    # Same checks as stripe.Webhook.construct_event, but parse with orjson into
+    # plain dicts instead of stdlib json + a StripeObject tree we never need.
+    # verify_header signs "%d.%s" % (t, payload), so it needs the body as str
+    # (bytes would format as "b'...'" and never match); orjson takes the bytes.
     try:
-        event = stripe.Webhook.construct_event(payload, sig, WEBHOOK_SECRET)
-    except ValueError:
+        body = payload.decode("utf-8")
+    except UnicodeDecodeError:
         return "Invalid payload", 400
+    try:
+        stripe.WebhookSignature.verify_header(body, sig, WEBHOOK_SECRET, stripe.Webhook.DEFAULT_TOLERANCE)
     except stripe.error.SignatureVerificationError:
         return "Invalid signature", 400
+    try:
+        event = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        return "Invalid payload", 400
 
     event_id   = event.get("id")
     event_type = event.get("type")
     obj        = event.get("data", {}).get("object", {})
 
-    # Deduplicate
-    if not upsert_event(event_id, event_type, obj):
-        return jsonify(ok=True, dedup=True)
-
-    try:
-        # ── Checkout completed (new sub) ──────────────────────────────────────
-        if event_type == "checkout.session.completed":
-            session = obj
-            if session.get("mode") == "subscription":
-                stripe_session_id = session.get("id")
-                sub_id = session.get("subscription")
-                user_id = safe_int(session.get("client_reference_id"))  # we pass discord user id here
-                price_id = None
-
-                # Optional: ensure it's our premium price before proceeding
-                try:
-                    sub = stripe.Subscription.retrieve(sub_id, expand=["items.data.price"])
-                    items = sub.get("items", {}).get("data", [])
-                    if items:
-                        price_id = items[0].get("price", {}).get("id")
-                except Exception as e:
-                    print("⚠️ Could not fetch sub on checkout:", e)
-
-                if price_id != PREMIUM_PRICE_ID:
-                    print(f"↪️ Ignoring checkout for non-premium price {price_id}")
-                    return jsonify(ok=True)
-
-                # Mirror all rows + promote user
-                resolved_user_id = sync_user_from_subscription(sub_id, explicit_user_id=user_id)
-
-                # If we saved mapping, PATCH @original with success embed
-                mapping = find_checkout_mapping(stripe_session_id)
-                if mapping:
-                    interaction_token, application_id, mapped_user = mapping
-                    if not resolved_user_id or mapped_user != resolved_user_id:
-                        # fallback; still patch success without user check
-                        pass
+    # Record + wake the inbox worker; the NOTIFY is delivered on commit. Stripe
+    # gets its 2xx without waiting on the Stripe API, Discord, or business SQL.
+    with get_db() as conn, conn.pipeline(), conn.cursor() as cur:
+        # Deduplicate
+        if not upsert_event(cur, event_id, event_type, obj):
+            return _DEDUP
+        notify_inbox(cur)
 
-                    payload = {
-                        "embeds": [{
-                            "title": "☑️ Bubu Bot Premium Activated",
-                            "description": "Thanks for your support! You now have access to all premium features.",
-                            "color": 0xBCE5FF
-                        }],
-                        "components": []
-                    }
-                    patch_interaction_original(application_id, interaction_token, payload)
-
-                post_support(f"🎉 User `{resolved_user_id}` started Bubu Bot Premium (sub `{sub_id}`).")
-
-        # ── Renewals ──────────────────────────────────────────────────────────
-        elif event_type == "invoice.payment_succeeded":
-            invoice = obj
-            sub_id = invoice.get("subscription")
-            if sub_id:
-                user_id = sync_user_from_subscription(sub_id)
-                if user_id:
-                    post_support(f"🔁 Premium renewed for user `{user_id}` (sub `{sub_id}`).")
-
-        # ── Payment failed (we DO NOT immediately revoke; wait for cancel/delete) ─
-        elif event_type == "invoice.payment_failed":
-            invoice = obj
-            sub_id = invoice.get("subscription")
-            if sub_id:
-                # still sync rows (status may be past_due)
-                sync_user_from_subscription(sub_id)
-
-        # ── Subscription updated (e.g., cancel_at_period_end toggled) ─────────
-        elif event_type == "customer.subscription.updated":
-            sub = obj
-            sub_id = sub.get("id")
-            user_id = sync_user_from_subscription(sub_id)
-
-        # ── Subscription canceled/deleted (hard revoke) ───────────────────────
-        elif event_type == "customer.subscription.deleted":
-            sub = obj
-            sub_id = sub.get("id")
-            user_id = sync_user_from_subscription(sub_id)  # final state mirror
-            # Resolve user from our table if not in metadata
-            if not user_id:
-                with get_db() as conn, conn.cursor() as cur:
-                    cur.execute("SELECT user_id FROM stripe_subscriptions WHERE subscription_id=%s", (sub_id,))
-                    row = cur.fetchone()
-                    user_id = row[0] if row else None
-            if user_id:
-                set_free(user_id, source="stripe", reason="subscription_deleted")
-                post_support(f"❌ Premium canceled for user `{user_id}` (sub `{sub_id}`).")
-
-    finally:
-        mark_event_processed(event_id)
-
-    return jsonify(ok=True)
+    return _OK
 
 @app.route("/")
 def home():